@@ -4,25 +4,297 @@
 # Simplified BSD License (see licenses/simplified_bsd.txt or https://opensource.org/licenses/BSD-2-Clause)
 from __future__ import (absolute_import, division, print_function)
 
+import errno
 import os
-from ansible.module_utils.common.text.converters import to_bytes, to_text
+import re
+import threading
 
-def get_path_filesystem(path):
-    """Returns the type of filesystem the given path resides on"""
-    # Modified from the AnsibleModule.is_special_selinux_path method
-    try:
-        f = open('/proc/mounts', 'r')
-        mount_data = f.readlines()
-        f.close()
-    except Exception:
-        return None
-    
+from ansible.module_utils.common.text.converters import to_bytes
+
+try:
+    import ctypes
+    HAS_CTYPES = True
+except ImportError:
+    HAS_CTYPES = False
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    HAS_FUTURES = True
+except ImportError:
+    HAS_FUTURES = False
+
+_MOUNTS_CACHE = None
+_SIZE_RE = re.compile(r'^\s*(\d*)\.?(\d*)\s*([A-Za-z]+)?')
+# Powers of 1024 for each size suffix
+_SIZE_UNITS = {'B': 0, 'K': 1, 'M': 2, 'G': 3, 'T': 4, 'P': 5, 'E': 6, 'Z': 7, 'Y': 8}
+_LIBC = None
+# statfs f_type magic numbers whose name in /proc/mounts is unambiguous.
+# ext2, ext3 and ext4 share a magic number so they are left to the
+# mount table
+_STATFS_MAGIC = {
+    0x01021994: 'tmpfs',
+    0x58465342: 'xfs',
+    0x9123683E: 'btrfs',
+    0xF2F52010: 'f2fs'
+}
+# 1MiB is the block size dd was given, large enough that each write
+# moves plenty of data per syscall
+_ZEROS = b'\0' * (1024 * 1024)
+# Several writes in flight keep a fast disk busy while zero filling
+_ZERO_FILL_WORKERS = 4
+# Cleared once sendfile is found not to accept /dev/zero
+_SENDFILE_ZEROS = hasattr(os, 'sendfile')
+# Written by mkswap in the last 10 bytes of the first page
+_SWAP_SIGNATURES = [b'SWAPSPACE2', b'SWAP-SPACE']
+_OCTAL_ESCAPE_RE = re.compile(r'\\([0-7]{3})')
+
+
+def _unescape_octal(field):
+    """Reverses the octal escaping of whitespace and backslashes in /proc files"""
+    if '\\' not in field:
+        return field
+    return _OCTAL_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+
+def _load_mounts():
+    """Returns a dict of mount points to filesystem types
+
+    /proc/mounts is only parsed on the first call. If it cannot be
+    read an empty dict is cached so we don't try again. Set
+    _MOUNTS_CACHE back to None to have it parsed again
+    """
+    global _MOUNTS_CACHE
+    if _MOUNTS_CACHE is None:
+        mounts = {}
+        try:
+            with open('/proc/mounts', 'r') as f:
+                for line in f:
+                    (device, mount_point, fstype, options, rest) = line.split(' ', 4)
+                    # Later entries are mounted over earlier ones, so the
+                    # last entry for a mount point is the one in use
+                    mounts[_unescape_octal(mount_point)] = fstype
+        except Exception:
+            mounts = {}
+        _MOUNTS_CACHE = mounts
+    return _MOUNTS_CACHE
+
+
+def find_mount_point(path):
+    """Returns the mount point the given canonical path resides on"""
+    # Unlike an os.path.ismount walk this needs no stat calls, only
+    # lookups in the cached mount table. Matching on st_dev instead
+    # would misidentify btrfs subvolumes, which have their own device
+    # id without being mounted, and would need a stat of every mount
+    # point, which can hang on an unreachable network filesystem
+    mounts = _load_mounts()
     prev_path = ''
     while path != prev_path:
-        for line in mount_data:
-            (device, mount_point, fstype, options, rest) = line.split(' ', 4)
-            if to_bytes(path) == to_bytes(mount_point):
-                return fstype
+        if path in mounts:
+            return path
         prev_path = path
         path = os.path.dirname(path)
     return None
+
+
+def size_to_bytes(size, default_unit=None):
+    """Converts a human readable size such as 4G or 1.5MB to bytes
+
+    Follows the same rules as ansible's human_to_bytes for byte sizes
+    but uses integer math throughout
+    """
+    match = _SIZE_RE.match(str(size))
+    (whole, fraction, unit) = match.groups()
+    if whole == '' and fraction == '':
+        raise ValueError("Can't interpret %s as a size" % size)
+
+    if unit is None:
+        unit = default_unit
+    if unit is None:
+        exponent = 0
+    else:
+        range_key = unit[0].upper()
+        if range_key not in _SIZE_UNITS:
+            raise ValueError(
+                'Failed to convert %s (unit = %s). The suffix must be one of %s'
+                % (size, unit, ', '.join(sorted(_SIZE_UNITS, key=_SIZE_UNITS.get, reverse=True)))
+            )
+        # Anything after the first letter must mean bytes. A lower
+        # case "b" is only accepted on its own
+        if len(unit) > 1 and 'byte' not in unit.lower() and unit[1] != 'B':
+            raise ValueError('Failed to convert %s. Value is not a valid string (expect %sB or %s)'
+                             % (size, range_key, range_key))
+        exponent = _SIZE_UNITS[range_key]
+
+    # The fraction is kept as a numerator and denominator and the
+    # result rounded to the nearest byte
+    denominator = 10 ** len(fraction)
+    numerator = int(whole or '0') * denominator + int(fraction or '0')
+    return (numerator * 1024 ** exponent * 2 + denominator) // (2 * denominator)
+
+
+def _statfs_type(path):
+    """Returns the filesystem type statfs reports for path
+
+    Returns None if statfs can't be called or the type is not one we
+    can name
+    """
+    global _LIBC
+    if not HAS_CTYPES:
+        return None
+    try:
+        if _LIBC is None:
+            # The running process already has libc loaded
+            _LIBC = ctypes.CDLL(None, use_errno=True)
+        # f_type is the first field of struct statfs. The buffer is
+        # large enough for the whole struct on every architecture
+        buf = ctypes.create_string_buffer(256)
+        if _LIBC.statfs(to_bytes(path, errors='surrogate_or_strict'), buf) != 0:
+            return None
+        f_type = ctypes.c_long.from_buffer(buf).value & 0xFFFFFFFF
+    except Exception:
+        return None
+    return _STATFS_MAGIC.get(f_type)
+
+
+def get_path_filesystem(path):
+    """Returns the type of filesystem the given path resides on"""
+    # A single statfs identifies most filesystems swap files are put
+    # on, and also gets btrfs subvolumes right
+    fstype = _statfs_type(path)
+    if fstype is not None:
+        return fstype
+
+    # Modified from the AnsibleModule.is_special_selinux_path method
+    mount_point = find_mount_point(path)
+    if mount_point is None:
+        return None
+    return _load_mounts()[mount_point]
+
+
+def has_swap_signature(path):
+    """Returns whether the file at path has a swap area signature
+
+    A file that can't be read is treated as having no signature
+    """
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.lseek(fd, page_size - 10, os.SEEK_SET)
+            # Reads short if the file is smaller than a page
+            signature = os.read(fd, 10)
+        finally:
+            os.close(fd)
+    except EnvironmentError:
+        return False
+    return signature in _SWAP_SIGNATURES
+
+
+def read_proc_swaps():
+    """Returns a dict of active swap paths to their priority"""
+    swaps = {}
+    try:
+        with open('/proc/swaps', 'r') as f:
+            # The first line is a header
+            next(f, None)
+            for line in f:
+                (filename, swap_type, size, used, priority) = line.split()
+                swaps[_unescape_octal(filename)] = int(priority)
+    except EnvironmentError:
+        # Without swap support in the kernel there is nothing active
+        return {}
+    return swaps
+
+
+def _sendfile_zeros(fd, offset, size, cancelled=None):
+    """Has the kernel copy zeros from /dev/zero to fd at offset
+
+    Returns the number of bytes written, which is less than size if
+    sendfile can't be used or the cancelled event is set
+    """
+    global _SENDFILE_ZEROS
+    written = 0
+    try:
+        # sendfile writes at the file position of its output, which is
+        # shared by everything using fd, so it gets its own descriptor
+        out_fd = os.open('/proc/self/fd/%d' % fd, os.O_WRONLY)
+    except EnvironmentError:
+        return written
+    try:
+        zero_fd = os.open('/dev/zero', os.O_RDONLY)
+        try:
+            os.lseek(out_fd, offset, os.SEEK_SET)
+            while written < size:
+                if cancelled is not None and cancelled.is_set():
+                    break
+                # Each call is capped so cancellation is noticed
+                sent = os.sendfile(out_fd, zero_fd, None, min(size - written, len(_ZEROS)))
+                if sent == 0:
+                    break
+                written += sent
+        finally:
+            os.close(zero_fd)
+    except EnvironmentError as e:
+        # Older kernels can't splice from /dev/zero
+        if e.errno not in [errno.EINVAL, errno.ENOSYS]:
+            raise
+        _SENDFILE_ZEROS = False
+    finally:
+        os.close(out_fd)
+    return written
+
+
+def _write_zeros(fd, offset, size, cancelled=None):
+    """Writes size bytes of zeros to fd at offset
+
+    Stops early once the cancelled event is set
+    """
+    if _SENDFILE_ZEROS:
+        # No user space buffer is needed at all
+        written = _sendfile_zeros(fd, offset, size, cancelled)
+        offset += written
+        size -= written
+
+    zeros = memoryview(_ZEROS)
+    if hasattr(os, 'pwrite'):
+        end = offset + size
+        while offset < end:
+            if cancelled is not None and cancelled.is_set():
+                return
+            offset += os.pwrite(fd, zeros[:min(end - offset, len(zeros))], offset)
+    else:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while size > 0:
+            if cancelled is not None and cancelled.is_set():
+                return
+            size -= os.write(fd, zeros[:min(size, len(zeros))])
+
+
+def zero_fill(fd, size):
+    """Writes size bytes of zeros to the start of fd"""
+    chunk_size = (size // _ZERO_FILL_WORKERS) // len(_ZEROS) * len(_ZEROS)
+    if not HAS_FUTURES or not hasattr(os, 'pwrite') or chunk_size == 0:
+        _write_zeros(fd, 0, size)
+        return
+
+    # Each thread fills its own region of the file. The writes
+    # release the GIL so they proceed in parallel
+    cancelled = threading.Event()
+    with ThreadPoolExecutor(max_workers=_ZERO_FILL_WORKERS) as executor:
+        try:
+            futures = []
+            for worker in range(_ZERO_FILL_WORKERS):
+                offset = worker * chunk_size
+                if worker == _ZERO_FILL_WORKERS - 1:
+                    length = size - offset
+                else:
+                    length = chunk_size
+                futures.append(executor.submit(_write_zeros, fd, offset, length, cancelled))
+            for future in futures:
+                # Raises any error hit while writing
+                future.result()
+        finally:
+            # Leaving the with block waits for every worker. On an error,
+            # or an exception raised by a signal handler, they must stop
+            # at their next write rather than fill the rest of the file
+            cancelled.set()
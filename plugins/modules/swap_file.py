@@ -20,7 +20,7 @@ options:
             - Intermediate directories will not be created if they do.
               not exist
         required: true
-        type: str
+        type: path
     priority:
         description:
             - Sets the swap priority of the swap file.
@@ -55,12 +55,15 @@ options:
     create_cmd:
         description:
             - 'By default the module does a best effort guess based on
-              the filesystem and kernel version to determine if
+              the filesystem, and on btrfs the kernel version, to determine if
               "fallocate" can be used to create a swap file at the
               specified path. "dd" is used if it determines that it
               cannot. You can explicitly choose the command with this
               option. Feel free to report any issues with the module
               automatically choosing or not choosing fallocate.'
+            - 'If "fallocate" was chosen automatically and it fails, or
+              swapon rejects the file it creates as invalid, the swap file
+              is created again using "dd".'
             - 'fallocate is faster but "Preallocated files created by
               fallocate(1) may be interpreted as files with holes too
               depending of the filesystem." which can cause swapon
@@ -131,58 +134,87 @@ priority:
     sample: -1
 '''
 
+import contextlib
 import os
+import re
 import tempfile
+import uuid
 import errno
 import signal
+import stat
+import struct
 import sys
 import platform
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.common.text import formatters, converters
-from ansible_collections.basicbind.swap_file.plugins.module_utils._version import LooseVersion
-from ansible_collections.basicbind.swap_file.plugins.module_utils._misc import get_path_filesystem
+from ansible.module_utils.common.text import converters
+from ansible_collections.basicbind.swap_file.plugins.module_utils._misc import (
+    get_path_filesystem,
+    has_swap_signature,
+    read_proc_swaps,
+    size_to_bytes,
+    zero_fill
+)
+
+
+def _get_kernel_version():
+    """Returns the (major, minor) version of the running kernel
+
+    Returns None if it cannot be determined
+    """
+    match = re.match(r'(\d+)(?:\.(\d+))?', platform.release())
+    if match is None:
+        return None
+    return (int(match.group(1)), int(match.group(2) or 0))
+
+
+_KERNEL_VERSION = _get_kernel_version()
 
 
 class SwapFile():
 
+    # swapon errors are matched on, so they must not be translated
+    _C_LOCALE = dict(LANG='C', LC_ALL='C', LC_MESSAGES='C')
+
+    # Options for the create commands. The block size is given to dd
+    # in bytes since not every dd understands suffixes such as MiB
+    _DD_OPTS = (
+        'if=/dev/zero',
+        'of=%(path)s',
+        'bs=%(block_size)d',
+        'count=%(count)d',
+        'conv=fsync'
+    )
+    _FALLOCATE_OPTS = ('--length', '%(size_in_mib)dMiB', '%(path)s')
+    # version, last_page, nr_badpages, uuid and volume_name from
+    # union swap_header in include/linux/swap.h
+    _SWAP_HEADER = struct.Struct('=III16s16s')
+
+    # Executable paths are shared by every SwapFile so PATH is only
+    # searched once for each executable actually used
+    _bin_paths = {}
+
     def __init__(self, module, path):
         self._module = module
         self._path = path
+        self._status_cache = None
+
+    def _get_bin_path(self, name):
+        """Returns the path of a required executable"""
+        if name not in SwapFile._bin_paths:
+            # Fails the module if it can't be found
+            SwapFile._bin_paths[name] = self._module.get_bin_path(name, required=True)
+        return SwapFile._bin_paths[name]
 
     def allocate(self, size_in_mib, create_cmd=None):
-        """Creates the swap file based on the filesystem it is being created on"""
+        """Creates the swap file based on the filesystem it is being created on
+
+        Returns the name of the command used to create the file
+        """
         # We currently assume the file exists at the set path.
         # Since we are currently only called with a pre-existing file
         # it's fine, but this may change
-
-        args_dict = {
-            'dd': {
-                'cmd': 'dd',
-                'opts': [
-                    'if=/dev/zero',
-                    'of=%s' % self._path,
-                    'bs=1MiB',
-                    'count=%s' % size_in_mib
-                ]
-            },
-            'fallocate': {
-                'cmd': 'fallocate',
-                'opts': [
-                    '--length',
-                    '%sMiB' % size_in_mib,
-                    self._path
-                ]
-            }
-        }
-
-        create_args_dict = args_dict['dd']
-
-        kernel_version = platform.release()
-        if kernel_version != '':
-            kernel_loose_version = LooseVersion(kernel_version)
-        else:
-            kernel_loose_version = LooseVersion('0')
+        chosen_cmd = 'dd'
 
         # ["ext4", "xfs", "btrfs"]
         fs = get_path_filesystem(self._path)
@@ -191,39 +223,38 @@ class SwapFile():
         if fs == 'btrfs':
             # If we can't determine the kernel version
             # we should still try to create the file
-            if (kernel_loose_version >= LooseVersion('5')
-                    or kernel_loose_version == LooseVersion('0')):
+            if _KERNEL_VERSION is None or _KERNEL_VERSION >= (5, 0):
                 nocow = True
-                create_args_dict = args_dict['fallocate']
+                chosen_cmd = 'fallocate'
             else:
                 err = 'Kernel version >= 5 needed for swap file support'
                 err += ' on btrfs'
                 raise RuntimeError(err)
-        elif fs == 'xfs':
-            if kernel_loose_version >= LooseVersion('4.18'):
-                create_args_dict = args_dict['fallocate']
-        elif fs == 'ext4':
-            # There should be support for using fallocated swap files on
-            # ext4 on earlier kernel versions, but some versions around 5.7
-            # to 5.8 appear to have a bug. For now we'll default to only
-            # using fallocate when the kernel version is above 5.11
-            if kernel_loose_version >= LooseVersion('5.11'):
-                create_args_dict = args_dict['fallocate']
+        elif fs == 'xfs' or fs == 'ext4':
+            # fallocated swap files are supported on xfs from 4.18 and on
+            # ext4 on most kernel versions, but some versions around 5.7
+            # to 5.8 appear to have a bug. We default to fallocate and the
+            # caller falls back to dd if swapon can't use the file
+            chosen_cmd = 'fallocate'
 
         if create_cmd is not None:
-            create_args_dict = args_dict[create_cmd]
+            chosen_cmd = create_cmd
 
         if nocow:
-            chattr_bin = self._module.get_bin_path('chattr', required=True)
+            chattr_bin = self._get_bin_path('chattr')
             chattr_args = [chattr_bin, '+C', self._path]
-            rc, out, err = self._module.run_command(chattr_args)
+            rc, out, err = self._maybe_run(chattr_args)
             if rc != 0:
                 raise RuntimeError('Unable to set No_COW attribute on swap file')
 
-        args = [self._module.get_bin_path(create_args_dict['cmd'], required=True)]
-        args += create_args_dict['opts']
+        rc, err = self._run_create_cmd(chosen_cmd, size_in_mib, fs)
+        self.clear_status()
+        if rc != 0 and create_cmd is None and chosen_cmd == 'fallocate':
+            # Not every filesystem supports fallocate. Since we chose it
+            # we fall back to dd
+            chosen_cmd = 'dd'
+            rc, err = self._run_create_cmd(chosen_cmd, size_in_mib, fs)
 
-        rc, out, err = self._module.run_command(args)
         if rc == 0:
             # The create operation can succeed but still fail to
             # create a properly sized swap file. Particularly when
@@ -233,8 +264,8 @@ class SwapFile():
             # it was properly created.
             # We're no longer using the btrfs command but I see no
             # reason to remove this test
-            if os.path.getsize(self._path) == formatters.human_to_bytes('%sM' % size_in_mib):
-                return
+            if os.path.getsize(self._path) == size_in_mib * 1024 * 1024:
+                return chosen_cmd
             else:
                 msg = 'Size of temp swap file is not correct. You'
                 msg += ' must have <swap file size> of free space'
@@ -242,9 +273,104 @@ class SwapFile():
         else:
             raise RuntimeError(err)
 
+    def _maybe_run(self, args, environ_update=None):
+        """Runs a command that modifies the target unless in check_mode"""
+        if self._module.check_mode:
+            return (0, '', '')
+        return self._module.run_command(args, environ_update=environ_update)
+
+    def _create_cmd_args(self, cmd, size_in_mib):
+        """Returns the arguments to run a create command with"""
+        if cmd == 'dd':
+            # Larger blocks mean fewer writes for dd on large swap files
+            if size_in_mib > 4096 and size_in_mib % 4 == 0:
+                block_mib = 4
+            else:
+                block_mib = 1
+            opts = [opt % {
+                'path': self._path,
+                'block_size': block_mib * 1024 * 1024,
+                'count': size_in_mib // block_mib
+            } for opt in self._DD_OPTS]
+        else:
+            opts = [opt % {
+                'path': self._path,
+                'size_in_mib': size_in_mib
+            } for opt in self._FALLOCATE_OPTS]
+        return [self._get_bin_path(cmd)] + opts
+
+    def _run_create_cmd(self, cmd, size_in_mib, fs):
+        """Runs a create command against the swap file
+
+        Returns the return code and error output of the command
+        """
+        if cmd == 'fallocate' and hasattr(os, 'posix_fallocate'):
+            # posix_fallocate makes the same fallocate(2) call as the
+            # fallocate command without spawning a process for it
+            try:
+                fd = os.open(self._path, os.O_WRONLY)
+                try:
+                    os.posix_fallocate(fd, 0, size_in_mib * 1024 * 1024)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                if e.errno not in [errno.ENOSYS, errno.EOPNOTSUPP]:
+                    return (1, converters.to_text(e))
+            else:
+                return (0, '')
+        elif cmd == 'dd':
+            # Writing the zeros ourselves saves spawning dd
+            size_in_bytes = size_in_mib * 1024 * 1024
+            try:
+                fd = os.open(self._path, os.O_WRONLY | os.O_TRUNC)
+                try:
+                    # These filesystems support fallocate. Reserving the
+                    # space fails early if there isn't enough and keeps
+                    # the file in as few extents as possible. The zeros
+                    # are still written since swapon may see the
+                    # preallocated extents as holes
+                    if fs in ['xfs', 'ext4', 'btrfs'] and hasattr(os, 'posix_fallocate'):
+                        os.posix_fallocate(fd, 0, size_in_bytes)
+                    zero_fill(fd, size_in_bytes)
+                    if hasattr(os, 'fdatasync'):
+                        os.fdatasync(fd)
+                    else:
+                        os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                # dd would fail the same way when out of space
+                if e.errno in [errno.ENOSPC, errno.EDQUOT]:
+                    return (1, converters.to_text(e))
+            else:
+                return (0, '')
+
+        args = self._create_cmd_args(cmd, size_in_mib)
+        rc, out, err = self._module.run_command(args)
+        return (rc, err)
+
+    def clear_status(self):
+        """Discards the cached status so it is read again on next use"""
+        self._status_cache = None
+
+    def set_status(self, status):
+        """Caches an already known status instead of reading it"""
+        self._status_cache = dict(status)
+
     def get_status(self, opt):
         """Returns the current status of the on disk swap file"""
-        default_status = {
+        if self._status_cache is None:
+            self.refresh_status()
+        return self._status_cache[opt]
+
+    def refresh_status(self):
+        """Reads the current status of the on disk swap file
+
+        Every status is gathered at once and cached so that each
+        external command is run at most once until the status is
+        cleared
+        """
+        status = {
             'exists': False,
             'is_on': False,
             'priority': None,
@@ -252,78 +378,111 @@ class SwapFile():
             'is_formatted': False
         }
 
-        status = default_status[opt]
+        # A single stat tells us both whether the
+        # swap file exists and its size
+        try:
+            stat_result = os.stat(self._path)
+        except OSError:
+            stat_result = None
 
         # Unless the swap file exists there
         # is no status to retrieve
-        if os.path.exists(self._path):
-            # Determine if the swap file exists
-            # If we get to this point, the file
-            # must exist
-            if opt == 'exists':
-                status = True
-
-            # Determine swap file size
-            elif opt == 'size':
-                status = os.path.getsize(self._path)
-
-            # Determine if swap area is on file
-            elif opt == 'is_formatted':
-                blkid_bin = self._module.get_bin_path('blkid', required=True)
-                blkid_args = [
-                    blkid_bin,
-                    '-s',
-                    'TYPE',
-                    '-o',
-                    'value',
-                    self._path
-                ]
-                rc, out, err = self._module.run_command(blkid_args)
-                if rc not in [0, 2]:
-                    raise RuntimeError(err)
-                else:
-                    if out.rstrip() == 'swap':
-                        status = True
-
-            # Determine if swap file is activated or its current priority
-            elif opt == 'is_on' or opt == 'priority':
-                swapon_bin = self._module.get_bin_path('swapon', required=True)
-                swapon_args = [
-                    swapon_bin,
-                    '--show=NAME,PRIO',
-                    '--noheadings',
-                ]
-                rc, out, err = self._module.run_command(swapon_args)
-                if rc == 0:
-                    swapon_lines = out.splitlines()
-                    for swapon_line in swapon_lines:
-                        (path, priority) = swapon_line.split()
-                        if path == self._path:
-                            if opt == 'is_on':
-                                status = True
-                            elif opt == 'priority':
-                                status = priority
-
+        if stat_result is not None:
+            status['exists'] = True
+            status['size'] = stat_result.st_size
+
+            # Determine if swap area is on file. The swap signature sits
+            # at the end of the first page so a smaller file, such as a
+            # freshly created temp file, can't have one
+            if status['size'] >= os.sysconf('SC_PAGE_SIZE'):
+                status['is_formatted'] = has_swap_signature(self._path)
+
+            # Determine if swap file is activated and its current priority
+            swaps = read_proc_swaps()
+            if self._path in swaps:
+                status['is_on'] = True
+                status['priority'] = swaps[self._path]
+
+        self._status_cache = status
         return status
 
+    def _write_swap_header(self, size_in_bytes):
+        """Writes the version 1 swap header mkswap would write
+
+        Returns False if the header could not be written, in which case
+        mkswap should be used
+        """
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        last_page = size_in_bytes // page_size - 1
+        # mkswap won't create a swap area smaller than 10 pages
+        if last_page < 9:
+            return False
+
+        # The first page holds the boot block, the header at 1024 bytes
+        # and the signature in its last 10 bytes. The kernel reads the
+        # header in native byte order
+        header = bytearray(page_size)
+        header[1024:1024 + self._SWAP_HEADER.size] = self._SWAP_HEADER.pack(
+            1, last_page, 0, uuid.uuid4().bytes, b''
+        )
+        header[page_size - 10:] = b'SWAPSPACE2'
+        try:
+            fd = os.open(self._path, os.O_WRONLY)
+            try:
+                written = 0
+                while written < page_size:
+                    written += os.write(fd, header[written:])
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except EnvironmentError:
+            return False
+        return True
+
     def mkswap(self):
         """Creates a swap area on swap file"""
         changed = False
-        mkswap_bin = self._module.get_bin_path('mkswap', required=True)
-        mkswap_args = [mkswap_bin, self._path]
 
         if not self.get_status('is_formatted'):
-            if self._module.check_mode:
-                rc = 0
-            else:
-                rc, out, err = self._module.run_command(mkswap_args)
+            if not self._module.check_mode and self._write_swap_header(self.get_status('size')):
+                self.clear_status()
+                return True
+
+            mkswap_args = [self._get_bin_path('mkswap'), self._path]
+            rc, out, err = self._maybe_run(mkswap_args)
             if rc == 0:
                 changed = True
+                self.clear_status()
             else:
                 raise RuntimeError(err)
 
         return changed
 
+    def test(self, priority):
+        """Formats a newly allocated swap file and ensures swapping can be enabled on it
+
+        The status of the swap file is not consulted since a new file
+        can't be formatted or in use
+        """
+        try:
+            if not self._write_swap_header(os.path.getsize(self._path)):
+                rc, out, err = self._module.run_command([self._get_bin_path('mkswap'), self._path])
+                if rc != 0:
+                    raise RuntimeError(err)
+
+            rc, out, err = self._module.run_command(
+                [self._get_bin_path('swapon'), '-p', str(priority), self._path],
+                environ_update=self._C_LOCALE
+            )
+            if rc != 0:
+                raise RuntimeError(err)
+
+            rc, out, err = self._module.run_command([self._get_bin_path('swapoff'), self._path])
+            if rc != 0:
+                raise RuntimeError('Could not deactivate temp swap file. %s' % err)
+        finally:
+            self.clear_status()
+
     def remove(self):
         """Removes the swap file"""
         changed = False
@@ -341,6 +500,7 @@ class SwapFile():
                     if e.errno != errno.ENOENT:
                         raise
             changed = True
+            self.clear_status()
         return changed
 
     def set_perms(self):
@@ -357,34 +517,35 @@ class SwapFile():
 
         return changed
 
+    def is_active(self, priority):
+        """Returns whether swapping is enabled on the swap file at the given priority"""
+        current_priority = self.get_status('priority')
+        if not self.get_status('is_on') or current_priority is None:
+            return False
+        # Any priority below 0 asks the system to handle
+        # setting the priority. So the priorities only differ
+        # if they aren't equal and either one is >= 0
+        return (priority == current_priority
+                or (priority < 0 and current_priority < 0))
+
     def swap_on(self, priority):
         """Enables swapping on swap file and ensures priority is set correctly"""
         changed = False
-        is_on = self.get_status('is_on')
-        current_priority = self.get_status('priority')
-        requested_priority = priority
 
-        # Any priority below 0 asks the system to handle
-        # setting the priority. So we only change the priority
-        # if the current priority and the requested priority
-        # differs and either one is >= 0
-        if ((not is_on) or (current_priority is None)
-                or ((int(requested_priority) != int(current_priority))
-                    and (int(requested_priority) >= 0 or int(current_priority) >= 0))):
+        if not self.is_active(priority):
             # We could be running swapon to change the priority on a currently
-            # enabled swap. If this is the case we want to swapoff first
-            if is_on:
+            # enabled swap. If this is the case we want to swapoff first.
+            # swap_off reads is_on from the same cached status
+            if self.get_status('is_on'):
                 self.swap_off()
 
-            swapon_bin = self._module.get_bin_path('swapon', required=True)
-            swapon_args = [swapon_bin, '-p', str(requested_priority), self._path]
+            swapon_bin = self._get_bin_path('swapon')
+            swapon_args = [swapon_bin, '-p', str(priority), self._path]
 
-            if self._module.check_mode:
-                rc = 0
-            else:
-                rc, out, err = self._module.run_command(swapon_args)
+            rc, out, err = self._maybe_run(swapon_args, environ_update=self._C_LOCALE)
             if rc == 0:
                 changed = True
+                self.clear_status()
             else:
                 raise RuntimeError(err)
 
@@ -392,16 +553,14 @@ class SwapFile():
 
     def swap_off(self):
         changed = False
-        swapoff_bin = self._module.get_bin_path('swapoff', required=True)
+        swapoff_bin = self._get_bin_path('swapoff')
         swapoff_args = [swapoff_bin, self._path]
 
         if self.get_status('is_on'):
-            if self._module.check_mode:
-                rc = 0
-            else:
-                rc, out, err = self._module.run_command(swapoff_args)
+            rc, out, err = self._maybe_run(swapoff_args)
             if rc == 0:
                 changed = True
+                self.clear_status()
             else:
                 err_msg = 'Could not deactivate swap file. Was it'
                 err_msg += ' mounted over? Is the path to it accessible?'
@@ -422,45 +581,38 @@ class SwapFileModule():
         self._changed = False
         self._module = module
         self._desired_state = module.params['state']
-        self._desired_path = module.params['path']
-        self._desired_size = module.params['size']
-        self._desired_priority = module.params['priority']
-        self._desired_create_cmd = module.params['create_cmd']
-        self._swap_file = SwapFile(module=self._module, path=self._desired_path)
-
-    @property
-    def _desired_path(self):
-        """Returns the _path attribute"""
-        return self.__desired_path
 
-    @_desired_path.setter
-    def _desired_path(self, path):
-        """Sets the _path attribute and validates it"""
+        # The argument spec has already checked the types and choices,
+        # which leaves only the checks below
+        path = module.params['path']
         # We verify that the path is an absolute path and that if the
         # swap file path exists, it is a regular file
-        if os.path.isabs(path):
-            path = os.path.realpath(path)
-            if os.path.exists(path) and not os.path.isfile(path):
-                self._fail('%s exists but is not a regular file' % path)
-            else:
-                self.__desired_path = path
-        else:
+        if not os.path.isabs(path):
             self._fail('Path must be an absolute path')
-
-    @property
-    def _desired_priority(self):
-        """Returns the __priority attribute"""
-        return self.__desired_priority
-
-    @_desired_priority.setter
-    def _desired_priority(self, priority):
-        """Sets the __priority attribute and validates it"""
-        priority = int(priority)
-        if (priority >= self._PRIORITY_MIN and priority <= self._PRIORITY_MAX):
-            self.__desired_priority = priority
-        else:
+        # realpath has to readlink every component of the path. A
+        # normalised path directly under / which isn't a symlink is
+        # already canonical, so the common "/swapfile" skips it.
+        # Any deeper path could have a symlinked parent directory
+        if (os.path.dirname(path) != '/' or os.path.normpath(path) != path
+                or os.path.islink(path)):
+            path = os.path.realpath(path)
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            stat_result = None
+        if stat_result is not None and not stat.S_ISREG(stat_result.st_mode):
+            self._fail('%s exists but is not a regular file' % path)
+
+        priority = module.params['priority']
+        if priority < self._PRIORITY_MIN or priority > self._PRIORITY_MAX:
             self._fail('priority is not between %s and %s' % (self._PRIORITY_MIN, self._PRIORITY_MAX))
 
+        self._desired_path = path
+        self._desired_priority = priority
+        self._desired_create_cmd = module.params['create_cmd']
+        self._desired_size = module.params['size']
+        self._swap_file = SwapFile(module=self._module, path=self._desired_path)
+
     @property
     def _desired_size_in_mib(self):
         return self.__desired_size_in_mib
@@ -482,36 +634,23 @@ class SwapFileModule():
 
         if size is not None or self._desired_state == 'present':
             try:
-                size_in_bytes = formatters.human_to_bytes(
-                    size,
-                    default_unit=self._SIZE_DEFAULT_UNIT,
-                    isbits=False
-                )
+                size_in_bytes = size_to_bytes(size, default_unit=self._SIZE_DEFAULT_UNIT)
             except ValueError as e:
                 self._fail(converters.to_text(e))
             else:
                 # We ensure the size is a multiple of 1Mebibyte
                 MB = 1024 * 1024
-                size_in_mib = int(round(size_in_bytes / MB))
-                size_in_bytes = int(size_in_mib * MB)
+                size_in_mib = (size_in_bytes + MB // 2) // MB
+                size_in_bytes = size_in_mib * MB
+                # Fail now rather than have dd create an empty file
+                # that swapon can't use
+                if self._desired_state == 'present' and size_in_mib < 1:
+                    self._fail('size must be at least 1M')
 
         self.__desired_size = size
         self.__desired_size_in_mib = size_in_mib
         self.__desired_size_in_bytes = size_in_bytes
 
-    @property
-    def _desired_create_cmd(self):
-        return self.__desired_create_cmd
-
-    @_desired_create_cmd.setter
-    def _desired_create_cmd(self, create_cmd):
-        create_cmd_opts = ['dd', 'fallocate']
-        if ((create_cmd in create_cmd_opts)
-                or (create_cmd is None)):
-            self.__desired_create_cmd = create_cmd
-        else:
-            self._fail('create_cmd must be one of [%s]' % ','.join(create_cmd_opts))
-
     def _absent(self):
         """Deactivates and removes swap file"""
         try:
@@ -520,6 +659,32 @@ class SwapFileModule():
         except Exception as e:
             self._fail(converters.to_text(e))
 
+    @contextlib.contextmanager
+    def _cleanup_guard(self):
+        """Ensures temp files are removed if killed/interrupted within the block"""
+        def _sig_handler(signum, frame):
+            self._module.do_cleanup_files()
+            signal.signal(signum, original_sig_handlers[signum])
+            # If we caught SIGINT, we should exit with SIGINT
+            if signum == signal.SIGINT:
+                os.kill(os.getpid(), signal.SIGINT)
+            else:
+                self._fail("Killed/Interrupted")
+
+        cleanup_sigs = [
+            signal.SIGTERM,
+            signal.SIGHUP,
+            signal.SIGINT
+        ]
+        original_sig_handlers = {}
+        for signum in cleanup_sigs:
+            original_sig_handlers[signum] = signal.signal(signum, _sig_handler)
+        try:
+            yield
+        finally:
+            for signum in cleanup_sigs:
+                signal.signal(signum, original_sig_handlers[signum])
+
     def _fail(self, msg):
         """Responsible for handling module failures"""
         fail_result = {'msg': msg}
@@ -536,40 +701,88 @@ class SwapFileModule():
         if ((not self._swap_file.get_status('exists'))
                 or not self._swap_file.get_status('size') == self._desired_size_in_bytes):
             if not self._module.check_mode:
-                # We create the temporary swap file in the same location
-                # the swap file will ultimately reside.
-                try:
-                    (tmpfd, tmp_swap_file_path) = tempfile.mkstemp(
-                        prefix=self._TMP_SWAP_FILE_PREFIX,
-                        dir=os.path.dirname(self._desired_path)
-                    )
-                except Exception as e:
-                    self._fail(converters.to_text(e))
-                try:
-                    os.close(tmpfd)
-                except Exception:
-                    pass
-
-                self._module.add_cleanup_file(tmp_swap_file_path)
-                try:
-                    tmp_swap_file = SwapFile(self._module, path=tmp_swap_file_path)
-                    tmp_swap_file.allocate(
-                        size_in_mib=self._desired_size_in_mib,
-                        create_cmd=self._desired_create_cmd
-                    )
-                    tmp_swap_file.mkswap()
-                    tmp_swap_file.swap_on(priority=self._desired_priority)
-                    tmp_swap_file.swap_off()
-                except Exception as e:
-                    self._fail('Swap file creation failed: %s' % converters.to_text(e))
-                try:
-                    self._swap_file.swap_off()
-                except Exception as e:
-                    self._fail(converters.to_text(e))
-
-                self._module.atomic_move(tmp_swap_file_path, self._desired_path)
+                # Temp files are only around from here until the swap
+                # file is moved into place
+                with self._cleanup_guard():
+                    # We create the temporary swap file in the same location
+                    # the swap file will ultimately reside.
+                    try:
+                        (tmpfd, tmp_swap_file_path) = tempfile.mkstemp(
+                            prefix=self._TMP_SWAP_FILE_PREFIX,
+                            dir=dir_path
+                        )
+                    except Exception as e:
+                        self._fail(converters.to_text(e))
+                    try:
+                        os.close(tmpfd)
+                    except Exception:
+                        pass
+
+                    self._module.add_cleanup_file(tmp_swap_file_path)
+                    try:
+                        tmp_swap_file = SwapFile(self._module, path=tmp_swap_file_path)
+                        create_cmd = tmp_swap_file.allocate(
+                            size_in_mib=self._desired_size_in_mib,
+                            create_cmd=self._desired_create_cmd
+                        )
+                        try:
+                            tmp_swap_file.test(priority=self._desired_priority)
+                        except Exception as e:
+                            # Files created by fallocate may be seen as having
+                            # holes, which swapon rejects with EINVAL. If we
+                            # chose fallocate ourselves we retry with dd. Other
+                            # failures would not be helped by rewriting the file
+                            if (self._desired_create_cmd is not None or create_cmd != 'fallocate'
+                                    or 'Invalid argument' not in converters.to_text(e)):
+                                raise
+                            tmp_swap_file.allocate(
+                                size_in_mib=self._desired_size_in_mib,
+                                create_cmd='dd'
+                            )
+                            tmp_swap_file.test(priority=self._desired_priority)
+                    except Exception as e:
+                        self._fail('Swap file creation failed: %s' % converters.to_text(e))
+                    try:
+                        self._swap_file.swap_off()
+                    except Exception as e:
+                        self._fail(converters.to_text(e))
+
+                    # The temp file is in the same directory as the swap file
+                    # so a rename is already atomic. Ownership and mode are
+                    # set by set_perms below
+                    renamed = False
+                    if os.path.dirname(tmp_swap_file_path) == dir_path:
+                        try:
+                            os.rename(tmp_swap_file_path, self._desired_path)
+                            renamed = True
+                        except OSError:
+                            pass
+                    if renamed:
+                        # atomic_move would have applied the default context
+                        # for the path. set_perms then sets the swapfile_t type
+                        self._module.set_default_selinux_context(self._desired_path, False)
+                    else:
+                        self._module.atomic_move(tmp_swap_file_path, self._desired_path)
+                    # The temp file was formatted and swapped off before the
+                    # move so there is no need to probe it again
+                    self._swap_file.set_status({
+                        'exists': True,
+                        'is_on': False,
+                        'priority': None,
+                        'size': self._desired_size_in_bytes,
+                        'is_formatted': True
+                    })
 
             self._changed = True
+        elif (self._swap_file.get_status('is_formatted')
+                and self._swap_file.is_active(self._desired_priority)):
+            # A swap file already set up by a previous run only needs
+            # its permissions checked
+            try:
+                self._changed |= self._swap_file.set_perms()
+            except Exception as e:
+                self._fail('Unable to modify swap file %s' % converters.to_text(e))
+            return
 
         try:
             self._changed |= self._swap_file.mkswap()
@@ -580,25 +793,6 @@ class SwapFileModule():
 
     def run(self):
         """Responsible for running the function responsible for each state"""
-        def _sig_handler(signum, frame):
-            self._module.do_cleanup_files()
-            signal.signal(signum, original_sig_handlers[signum])
-            # If we caught SIGINT, we should exit with SIGINT
-            if signum == signal.SIGINT:
-                os.kill(os.getpid(), signal.SIGINT)
-            else:
-                self._fail("Killed/Interrupted")
-
-        # Ensure we cleanup if killed/interrupted
-        cleanup_sigs = [
-            signal.SIGTERM,
-            signal.SIGHUP,
-            signal.SIGINT
-        ]
-        original_sig_handlers = {}
-        for signum in cleanup_sigs:
-            original_sig_handlers[signum] = signal.signal(signum, _sig_handler)
-
         if self._desired_state == 'present':
             self._present()
         elif self._desired_state == 'absent':
@@ -619,7 +813,7 @@ def main():
 
     # The arguments which can be sent by the user
     module_args = dict(
-        path=dict(type='str', required=True),
+        path=dict(type='path', required=True),
         priority=dict(type='int', required=False, default=-1),
         size=dict(type='str', required=False),
         state=dict(type='str', required=False, choices=['absent', 'present'], default='present'),